@@ -1,6 +1,29 @@
+import logging
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import xlsxwriter
+
+try:
+    import polars as pl
+except ImportError:  # Fall back to pandas for the damage ratio calculation
+    pl = None
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:  # Run the kernels as plain Python loops over NumPy arrays
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+# np.trapz was renamed to np.trapezoid in NumPy 2.0 (and removed later)
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+logger = logging.getLogger(__name__)
 
 # Set Times New Roman as the font for all matplotlib plots
 plt.rcParams['font.family'] = 'Times New Roman'
@@ -13,27 +36,45 @@ plt.rcParams['font.family'] = 'Times New Roman'
 def calculate_damage_ratio():
     """
     Reads raw building sample data from an Excel file,
-    performs one-hot encoding on the 'CapStatus' column, and calculates a
+    derives the 'CapStatus_Undercap' indicator from 'CapStatus', and calculates a
     normalised Damage Ratio within each 'CapStatus_Undercap' group.
-    The updated DataFrame is then saved to an output Excel file.
+    The updated DataFrame is then saved to an intermediate Parquet file.
     """
     # File paths (adjust as necessary)
     input_file = 'BuildingSamples.xlsx'  # Update your Excel document
-    output_file = 'BuildingSamples_with_damage_ratio.xlsx'
+    output_file = 'BuildingSamples_with_damage_ratio.parquet'
 
     # Load the Excel file containing raw building sample data
     df = pd.read_excel(input_file)
 
-    # Perform one-hot encoding on the 'CapStatus' column to create indicator variables
-    df = pd.get_dummies(df, columns=['CapStatus'], prefix='CapStatus')
+    # Downcast bounded numeric columns to float32 to halve storage and kernel memory traffic.
+    # 'Repair Cost' stays float64 so the reported costs keep their cents; the Damage Ratio,
+    # normalised columns and PRI are computed in float64 so the ranking order is unaffected.
+    for column in ['Policy Preference', 'Required Resources', 'Repair time']:
+        if column in df.columns:
+            df[column] = df[column].astype(np.float32)
 
-    # Calculate the Damage Ratio by normalising 'Total Building Paid Incl GST'
-    # within each group defined by 'CapStatus_Undercap'
-    df['Damage Ratio'] = df.groupby('CapStatus_Undercap')['Repair Cost'] \
-        .transform(lambda x: (x - x.min()) / (x.max() - x.min()))
+    # Create the 'CapStatus_Undercap' indicator variable (the only one used downstream)
+    df['CapStatus_Undercap'] = (df['CapStatus'].values == 'Undercap')
 
-    # Save the updated DataFrame with Damage Ratio to a new Excel file
-    df.to_excel(output_file, index=False)
+    # Calculate the Damage Ratio by normalising 'Total Building Paid Incl GST'
+    # within each group defined by 'CapStatus_Undercap' (Polars window expressions run multi-threaded)
+    if pl is not None:
+        cost = pl.col('Repair Cost')
+        gmin = cost.min().over('CapStatus_Undercap')
+        gmax = cost.max().over('CapStatus_Undercap')
+        pdf = pl.from_pandas(df[['CapStatus_Undercap', 'Repair Cost']])
+        df['Damage Ratio'] = pdf.select((cost - gmin) / (gmax - gmin)).to_series().to_numpy()
+    else:
+        # Aggregate the group bounds once, then map them back onto each row with a left merge
+        aggs = df.groupby('CapStatus_Undercap')['Repair Cost'].agg(['min', 'max']).reset_index()
+        bounds = df[['CapStatus_Undercap']].merge(aggs, on='CapStatus_Undercap', how='left')
+        gmin = bounds['min'].to_numpy()
+        gmax = bounds['max'].to_numpy()
+        df['Damage Ratio'] = (df['Repair Cost'].to_numpy(dtype=np.float64) - gmin) / (gmax - gmin)
+
+    # Save the updated DataFrame with Damage Ratio to a new Parquet file
+    df.to_parquet(output_file, index=False)
 
     print(f"Damage ratio calculation completed. Results have been saved to {output_file}")
     return df
@@ -43,41 +84,72 @@ def calculate_damage_ratio():
 # STEP 2: BUILDING PRIORITISATION
 ##############################
 
+if HAVE_NUMBA:
+    @njit(cache=True)
+    def _column_min_max(arr):
+        """
+        Returns the per-column minima and maxima of a 2-D array in a single pass, ignoring NaNs.
+        """
+        n_rows, n_cols = arr.shape
+        mins = np.full(n_cols, np.inf, dtype=arr.dtype)
+        maxs = np.full(n_cols, -np.inf, dtype=arr.dtype)
+        for i in range(n_rows):
+            for j in range(n_cols):
+                value = arr[i, j]
+                # NaN compares False, so missing values are skipped
+                if value < mins[j]:
+                    mins[j] = value
+                if value > maxs[j]:
+                    maxs[j] = value
+        return mins, maxs
+else:
+    def _column_min_max(arr):
+        """
+        Returns the per-column minima and maxima of a 2-D array, ignoring NaNs. Without numba,
+        NumPy's reductions are much faster than a Python loop over the elements.
+        """
+        return np.nanmin(arr, axis=0), np.nanmax(arr, axis=0)
+
+
 def prioritise_buildings():
     """
-    Reads experimental building data from an Excel file, verifies necessary columns,
+    Reads experimental building data from a Parquet file, verifies necessary columns,
     normalises specific columns (Repair Cost and Policy Preference), and computes a PRI index.
-    The DataFrame is then sorted by the PRI index in descending order and saved to an output Excel file.
+    The DataFrame is then sorted by the PRI index in descending order and saved to an output Excel file,
+    with a Parquet copy kept as the input for resource allocation.
     """
     # File path and sheet name (adjust as necessary)
-    input_file = 'BuildingSamples_with_damage_ratio.xlsx'
+    input_file = 'BuildingSamples_with_damage_ratio.parquet'
     sheet_name = 'Sheet1'
 
-    # Load the Excel file into a DataFrame
-    df = pd.read_excel(input_file, sheet_name=sheet_name)
+    # Load the Parquet file into a DataFrame
+    df = pd.read_parquet(input_file)
 
     # Verify that the required columns exist in the DataFrame
     required_columns = ['Damage Ratio', 'Repair Cost', 'Importance Level', 'Policy Preference']
-    for column in required_columns:
-        if column not in df.columns:
-            raise ValueError(f"Column '{column}' not found in the DataFrame")
+    missing = set(required_columns) - set(df.columns)
+    if missing:
+        raise ValueError(f"Columns {sorted(missing)} not found in the DataFrame")
 
-    # Normalise 'Repair Cost' and 'Policy Preference'
-    df['Repair Cost_normalized'] = (df['Repair Cost'] - df['Repair Cost'].min()) / \
-                                   (df['Repair Cost'].max() - df['Repair Cost'].min())
-    df['Policy Preference_normalized'] = (df['Policy Preference'] - df['Policy Preference'].min()) / \
-                                         (df['Policy Preference'].max() - df['Policy Preference'].min())
+    # Normalise 'Repair Cost' and 'Policy Preference' in one pass over a contiguous array
+    arr = df[['Repair Cost', 'Policy Preference']].to_numpy(dtype=np.float64)
+    mins, maxs = _column_min_max(arr)
+    norm = (arr - mins) / (maxs - mins)
+    df['Repair Cost_normalized'] = norm[:, 0]
+    df['Policy Preference_normalized'] = norm[:, 1]
 
     # Calculate the PRI index, giving equal weight to Damage Ratio, Repair Cost, and Policy Preference
-    df['PRI'] = 0.25 * df['Damage Ratio'] + 0.25 * df['Repair Cost_normalized'] + \
-                0.25 * df['Policy Preference_normalized']
+    # (Damage Ratio is already normalised within each CapStatus group)
+    df['PRI'] = 0.25 * (df['Damage Ratio'].to_numpy(dtype=np.float64) + norm.sum(axis=1))
 
     # Sort the DataFrame by PRI in descending order
-    df_sorted = df.sort_values(by='PRI', ascending=False)
+    order = np.argsort(-df['PRI'].to_numpy(dtype=np.float64), kind='stable')
+    df_sorted = df.iloc[order]
 
     # Save the sorted DataFrame to an Excel file
     output_file = 'Option 1-Results_Ranked_Buildings.xlsx'
-    df_sorted.to_excel(output_file, sheet_name=sheet_name, index=False)
+    df_sorted.to_excel(output_file, sheet_name=sheet_name, index=False, engine='xlsxwriter')
+    df_sorted.to_parquet('Option 1-Results_Ranked_Buildings.parquet', index=False)
 
     print(f"Building prioritisation completed. Sorted data has been saved to {output_file}")
     print(df_sorted)
@@ -88,15 +160,118 @@ def prioritise_buildings():
 # STEP 3: RESOURCE ALLOCATION AND RECOVERY ANALYSIS
 ##############################
 
+@njit(cache=True)
+def _simulate(R_ID_arr, RT_ID_arr, R_t, factor):
+    """
+    Sequential queuing kernel for a single scenario. Buildings are processed in the
+    given (PRI) order; returns the waiting and recovery time arrays. Inputs may be float32,
+    but the running times and resource pool are accumulated in float64.
+    """
+    n = R_ID_arr.shape[0]
+    waiting = np.empty(n)
+    recovery = np.empty(n)
+    t = 0.0
+
+    # Loop-invariant mobilisation terms used to compute the time to accumulate missing resources
+    offset = 2.5169 * factor
+    inv_slope = 1.0 / (0.8194 * factor)
+
+    # Initialise previous building variables
+    W_ID_prev = 0.0
+    T_ID_prev = 0.0
+    R_ID_prev = 0.0
+
+    for i in range(n):
+        R_ID = R_ID_arr[i]
+        RT_ID = RT_ID_arr[i]
+        W_ID = 0.0  # initialise current waiting time
+
+        if R_t >= R_ID:  # Sufficient resources available
+            W_ID = 0.0
+            t += W_ID
+            R_t -= R_ID
+            T_ID = W_ID + RT_ID
+        else:  # Insufficient resources available
+            if t > T_ID_prev:
+                # Release resources from previous building
+                R_t += R_ID_prev
+                if R_t >= R_ID:
+                    W_ID = W_ID_prev
+                    T_ID = RT_ID + W_ID
+                    R_t -= R_ID
+                    t += W_ID
+                else:
+                    t_req_ID = ((R_ID - R_t) + offset) * inv_slope
+                    W_ID = t_req_ID + W_ID_prev
+                    R_t -= R_ID
+                    t = W_ID
+                    T_ID = RT_ID + W_ID
+            else:
+                t_req_ID = ((R_ID - R_t) + offset) * inv_slope
+                W_ID = t_req_ID + W_ID_prev
+                R_t -= R_ID
+                t = W_ID
+                T_ID = RT_ID + W_ID
+
+        waiting[i] = W_ID
+        recovery[i] = T_ID
+
+        # Update previous building values for the next iteration
+        R_ID_prev = R_ID
+        W_ID_prev = W_ID
+        T_ID_prev = T_ID
+
+    return waiting, recovery
+
+
+@njit(parallel=True, cache=True)
+def _simulate_scenarios(R_ID_arr, RT_ID_arr, R_t_arr, factors):
+    """
+    Runs the queuing kernel for every scenario in parallel. Row k of the returned
+    arrays holds the waiting and recovery times for scenario k.
+    """
+    n_scenarios = factors.shape[0]
+    waiting = np.empty((n_scenarios, R_ID_arr.shape[0]))
+    recovery = np.empty((n_scenarios, R_ID_arr.shape[0]))
+    for k in prange(n_scenarios):
+        scenario_waiting, scenario_recovery = _simulate(R_ID_arr, RT_ID_arr, R_t_arr[k], factors[k])
+        waiting[k, :] = scenario_waiting
+        recovery[k, :] = scenario_recovery
+    return waiting, recovery
+
+
+def _write_scenario_sheets(output_file, results):
+    """
+    Writes each scenario DataFrame to its own sheet of an Excel file, streaming the values
+    row by row through xlsxwriter in constant_memory mode.
+    """
+    workbook = xlsxwriter.Workbook(output_file, {'constant_memory': True})
+    # Same default as to_excel, otherwise Excel shows datetimes as bare serial numbers
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    for scenario_name, df in results.items():
+        worksheet = workbook.add_worksheet(scenario_name)
+        worksheet.write_row(0, 0, df.columns.tolist())
+        datetime_columns = [col for col, dtype in enumerate(df.dtypes)
+                            if pd.api.types.is_datetime64_any_dtype(dtype)]
+        for row, values_row in enumerate(df.itertuples(index=False, name=None), start=1):
+            # Missing values are left as blank cells
+            values_row = [None if pd.isna(value) else value for value in values_row]
+            worksheet.write_row(row, 0, values_row)
+            for col in datetime_columns:
+                if values_row[col] is not None:
+                    worksheet.write_datetime(row, col, values_row[col].to_pydatetime(), datetime_format)
+    workbook.close()
+
+
 def allocate_resources():
     """
-    Reads building ranking data from an Excel file, allocates resources based on
+    Reads building ranking data from a Parquet file, allocates resources based on
     scenario-specific mobilisation factors, computes waiting and recovery times
     for each building, and writes the results for each scenario to separate sheets
-    in an integrated Excel file.
+    in an integrated Excel file. The scenario DataFrames are also returned, keyed by
+    scenario name, so they can be plotted without re-reading the workbook.
     """
-    input_file = 'Option 1-Results_Ranked_Buildings.xlsx'
-    input_sheet = 'Sheet1'
+    input_file = 'Option 1-Results_Ranked_Buildings.parquet'
     output_file = 'Integrated_Updated_Data_rank_buildings.xlsx'
 
     # Initial resource pool at time t = 0
@@ -113,108 +288,68 @@ def allocate_resources():
         # This is informed by dynamic resource mobilisation patterns based on New Zealand immigration data.
         return (0.8194 * t - 2.1569) * factor
 
-    # Create an Excel writer to store scenario outputs in one file
-    with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
-        for scenario_name, factor in scenarios.items():
-            df = pd.read_excel(input_file, sheet_name=input_sheet)
-            t = 0
-            R_t = (R_0 + calculate_RM_t(t, factor)) * 0.7  # turnover rate is 0.3
-
-            # Initialise previous building variables
-            W_ID_prev = 0
-            T_ID_prev = 0
-            R_ID_prev = 0
-
-            waiting_times = []
-            recovery_times = []
-
-            for index, building in df.iterrows():
-                building_ID = building['Building ID']
-                R_ID = building['Required Resources']
-                RT_ID = building['Repair time']
-                W_ID = 0  # initialise current waiting time
-
-                if R_t >= R_ID:  # Sufficient resources available
-                    W_ID = 0
-                    t += W_ID
-                    R_t -= R_ID
-                    T_ID = W_ID + RT_ID
-                else:  # Insufficient resources available
-                    if t > T_ID_prev:
-                        # Release resources from previous building
-                        R_t += R_ID_prev
-                        if R_t >= R_ID:
-                            W_ID = W_ID_prev
-                            T_ID = RT_ID + W_ID
-                            R_t -= R_ID
-                            t += W_ID
-                        else:
-                            t_req_ID = ((R_ID - R_t) + 2.5169 * factor) / (0.8194 * factor)
-                            W_ID = t_req_ID + W_ID_prev
-                            R_t -= R_ID
-                            t = W_ID
-                            T_ID = RT_ID + W_ID
-                    else:
-                        t_req_ID = ((R_ID - R_t) + 2.5169 * factor) / (0.8194 * factor)
-                        W_ID = t_req_ID + W_ID_prev
-                        R_t -= R_ID
-                        t = W_ID
-                        T_ID = RT_ID + W_ID
-
-                waiting_times.append(W_ID)
-                recovery_times.append(T_ID)
-
-                # Update previous building values for the next iteration
-                R_ID_prev = R_ID
-                W_ID_prev = W_ID
-                T_ID_prev = T_ID
-
-                print(f"Allocate resources to Building ID {building_ID} under {scenario_name}:")
-                print(f"At time {t}:")
-                print(f"Waiting time (W_ID): {W_ID} days")
-                print(f"Recovery time (T_ID): {T_ID} days\n")
-
-            df['Waiting Time'] = waiting_times
-            df['Recovery Time'] = recovery_times
-
-            # Create a Rank column if one does not exist (assume the order reflects PRI order)
-            if 'Rank' not in df.columns:
-                df['Rank'] = np.arange(1, len(df) + 1)
-
-            df.to_excel(writer, sheet_name=scenario_name, index=False)
+    # Load the ranked buildings once and copy them for each scenario
+    base_df = pd.read_parquet(input_file)
+    results = {}
 
+    # Allocate resources to each building in PRI order, running the independent scenarios in parallel
+    factors = np.array(list(scenarios.values()), dtype=np.float64)
+    R_t = (R_0 + calculate_RM_t(0, factors)) * 0.7  # turnover rate is 0.3
+    R_ID = base_df['Required Resources'].to_numpy(dtype=np.float32)
+    RT_ID = base_df['Repair time'].to_numpy(dtype=np.float32)
+    waiting, recovery = _simulate_scenarios(R_ID, RT_ID, R_t, factors)
+
+    for scenario_name, waiting_times, recovery_times in zip(scenarios, waiting, recovery):
+        df = base_df.copy()
+
+        # Per-building allocation details are only formatted when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            for building_ID, W_ID, T_ID in zip(df['Building ID'], waiting_times, recovery_times):
+                logger.debug("Building ID %s under %s: W_ID=%f days, T_ID=%f days",
+                             building_ID, scenario_name, W_ID, T_ID)
+
+        df['Waiting Time'] = waiting_times
+        df['Recovery Time'] = recovery_times
+
+        # Create a Rank column if one does not exist (assume the order reflects PRI order)
+        if 'Rank' not in df.columns:
+            df['Rank'] = np.arange(1, len(df) + 1)
+
+        results[scenario_name] = df
+
+    # Store scenario outputs in one file
+    _write_scenario_sheets(output_file, results)
     print("Resource allocation results have been saved to the integrated Excel file for all scenarios.")
-    return output_file
+    return results
 
 
 ##############################
 # STEP 4: VISUALISATION
 ##############################
 
-def plot_gantt_charts():
+def plot_gantt_charts(dfs):
     """
-    Reads the integrated resource allocation results and generates horizontal Gantt charts
-    for building repair and waiting times for each scenario.
+    Takes the resource allocation results (a dict of scenario DataFrames, as returned by
+    allocate_resources) and generates horizontal Gantt charts for building repair and
+    waiting times for each scenario.
     """
-    input_file = 'Integrated_Updated_Data_rank_buildings.xlsx'
     sheet_names = ['S1', 'S2', 'S3']
-    dataframes = [pd.read_excel(input_file, sheet_name=sheet) for sheet in sheet_names]
+    dataframes = [dfs[sheet] for sheet in sheet_names]
 
     fig, axes = plt.subplots(nrows=1, ncols=3, figsize=(24, 10))
     subplot_labels = ['(a)', '(b)', '(c)']
 
     for idx, (ax, dataframe, sheet_name) in enumerate(zip(axes, dataframes, sheet_names)):
-        if 'Rank' in dataframe.columns:
-            dataframe = dataframe.sort_values('Rank')
-        else:
+        # Rows are already in Rank (PRI) order; create a Rank column if one does not exist
+        if 'Rank' not in dataframe.columns:
             dataframe['Rank'] = np.arange(1, len(dataframe) + 1)
 
-        for index, row in dataframe.iterrows():
-            ax.barh(row['Rank'], row['Repair time'], left=row['Waiting Time'],
-                    color='orange', edgecolor='black',
-                    label='Repair time' if index == 0 else "")
-            ax.barh(row['Rank'], row['Waiting Time'], color='grey', edgecolor='black',
-                    label='Waiting time' if index == 0 else "")
+        ranks = dataframe['Rank'].to_numpy()
+        waiting_time = dataframe['Waiting Time'].to_numpy()
+        repair_time = dataframe['Repair time'].to_numpy()
+        ax.barh(ranks, repair_time, left=waiting_time, color='orange', edgecolor='black',
+                label='Repair time')
+        ax.barh(ranks, waiting_time, color='grey', edgecolor='black', label='Waiting time')
 
         ax.set_xlabel('Time (days)', fontsize=22)
         ax.set_title(f'{subplot_labels[idx]} Building Repair and Recovery Gantt Chart - {sheet_name}', fontsize=22,
@@ -234,10 +369,11 @@ def plot_gantt_charts():
     plt.show()
 
 
-def plot_recovery_ecdf(integrated_file):
+def plot_recovery_ecdf(dfs):
     """
-    For each scenario, sorts the building recovery times by rank, then plots the recovery trajectory
-    using an ECDF-based method. The area under the ECDF curve (enclosed by y=0, y=1 and a fixed t value)
+    For each scenario in the resource allocation results (a dict of scenario DataFrames), plots
+    the recovery trajectory of the buildings (already in rank order) using an ECDF-based method.
+    The area under the ECDF curve (enclosed by y=0, y=1 and a fixed t value)
     is computed using a step ECDF method.
     """
     sheet_names = ['S1', 'S2', 'S3']
@@ -255,19 +391,22 @@ def plot_recovery_ecdf(integrated_file):
         return x, y
 
     def step_ecdf(x, y):
-        x_step = np.repeat(x, 2)[1:]
-        y_step = np.repeat(y, 2)[:-1]
-        x_step = np.insert(x_step, 0, x[0])
-        y_step = np.insert(y_step, 0, 0)
+        # Fill preallocated buffers: each x value appears twice, y steps up at each x
+        n = len(x)
+        x_step = np.empty(2 * n)
+        y_step = np.empty(2 * n)
+        x_step[0::2] = x
+        x_step[1::2] = x
+        y_step[0] = 0
+        y_step[1::2] = y
+        y_step[2::2] = y[:-1]
         return x_step, y_step
 
     # Process each scenario sheet
-    for sheet, color, label in zip(sheet_names, colors, labels):
-        df = pd.read_excel(integrated_file, sheet_name=sheet)
-        # Ensure ordering by Rank
-        if 'Rank' in df.columns:
-            df = df.sort_values('Rank')
-        else:
+    dataframes = [dfs[sheet] for sheet in sheet_names]
+    for df, color, label in zip(dataframes, colors, labels):
+        # Rows are already in Rank (PRI) order; create a Rank column if one does not exist
+        if 'Rank' not in df.columns:
             df['Rank'] = np.arange(1, len(df) + 1)
 
         # Use the 'Recovery Time' column as the data for ECDF
@@ -282,9 +421,8 @@ def plot_recovery_ecdf(integrated_file):
         # Calculate area enclosed by the ECDF curve, the x-axis, and vertical lines at x=0 and x=t_max.
         # The provided method uses t_max = 5152; adjust if necessary.
         t_max = 5152  # This is informed by the max values of the recovery time.
-        x_closed = np.concatenate(([0], x_step, [t_max, t_max, 0]))
-        y_closed = np.concatenate(([0], y_step, [1, 0, 0]))
-        area = np.trapz(y_closed, x_closed)
+        # The curve ends at y=1, so the remaining area up to t_max is a rectangle of height 1.
+        area = trapezoid(y_step, x_step) + (t_max - x_step[-1])
         areas.append(area)
 
     plt.xlabel('Recovery Time (days)', fontsize=22)
@@ -323,13 +461,13 @@ def main():
     prioritise_buildings()
 
     # Step 3: Allocate resources and compute recovery times (uses output from prioritisation)
-    integrated_file = allocate_resources()
+    scenario_results = allocate_resources()
 
     # Step 4: Generate Gantt charts
-    plot_gantt_charts()
+    plot_gantt_charts(scenario_results)
 
     # Step 5: Plot recovery trajectory ECDF and compute area under the curve
-    plot_recovery_ecdf(integrated_file)
+    plot_recovery_ecdf(scenario_results)
 
 
 if __name__ == '__main__':